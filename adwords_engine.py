@@ -12,13 +12,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import csv
 import datetime
+import gzip
+import io
+import re
 
 from googleads import adwords
 from csv_data import AdsCampaign, AdsGroup, AdsKeyword
 
 ADWORDS_VERSION = 'v201809'
 PAGE_SIZE = 1000
+KEYWORDS_BATCH_SIZE = 500 # Max keywords sent in one mutate call
+KEYWORDS_LOOKUP_CHUNK_SIZE = 100 # Keyword texts per IN predicate
+KEYWORDS_LOOKUP_RATIO = 0.2 # Look up keywords when they are less than 20% of the ads group
+
+# Columns of the structure reports, in the CSV order.
+# Each report selects the first N columns (see STRUCTURE_REPORTS).
+STRUCTURE_REPORT_FIELDS = [
+    'CampaignId',
+    'CampaignName',
+    'AdGroupId',
+    'AdGroupName',
+    'Criteria',
+    'KeywordMatchType',
+]
+STRUCTURE_REPORTS = [
+    ('CAMPAIGN_PERFORMANCE_REPORT', 2),
+    ('ADGROUP_PERFORMANCE_REPORT', 4),
+    ('KEYWORDS_PERFORMANCE_REPORT', 6),
+]
 
 """
 Get customer ID with the right pattern.
@@ -119,6 +142,7 @@ def create_adwords_campaign(client, campaign: AdsCampaign):
         }
     }]
     campaigns = campaign_service.mutate(operations)
+    return campaigns['value'][0]['id']
 
 """
 Create an Adwords ad group.
@@ -162,32 +186,75 @@ def create_adwords_ad_group(client, campaign_id, ad_group: AdsGroup):
         }
     }]
     ad_groups = ad_group_service.mutate(operations)
+    return ad_groups['value'][0]['id']
 
 """
 Create an Adwords keyword.
+Returns the rejected keyword with its error, if any (see create_adwords_keywords).
 """
 def create_adwords_keyword(client, ad_group_id, keyword: AdsKeyword):
-    ad_group_criterion_service = client.GetService(
-        'AdGroupCriterionService', version=ADWORDS_VERSION)
-
-    keyword1 = {
-        'xsi_type': 'BiddableAdGroupCriterion',
-        'adGroupId': ad_group_id,
-        'criterion': {
-            'xsi_type': 'Keyword',
-            'matchType': keyword.targeting,
-            'text': keyword.text
-        }
-    }
+    return create_adwords_keywords(client, ad_group_id, [keyword])
+
+"""
+Return the index of the operation that caused a partial failure error,
+or None if the error isn't related to an operation.
+"""
+def get_adwords_error_operation_index(error):
+    if 'fieldPathElements' in error and error['fieldPathElements']:
+        for element in error['fieldPathElements']:
+            if element['field'] == 'operations' and element['index'] is not None:
+                return int(element['index'])
+    if 'fieldPath' in error and error['fieldPath']:
+        match = re.match(r'^operations\[(\d+)\]', error['fieldPath'])
+        if match:
+            return int(match.group(1))
+    return None
 
-    operations = [
-        {
+"""
+Create many Adwords keywords of an ad group with a single mutate call.
+The call uses the partial failure mode : valid keywords are created even
+if some others are rejected (policy violation, too long text...).
+Returns a list of (rejected AdsKeyword(), error).
+"""
+def create_adwords_keywords(client, ad_group_id, keywords):
+    operations = []
+    for keyword in keywords:
+        operations.append({
             'operator': 'ADD',
-            'operand': keyword1
-        }
-    ]
-    ad_group_criteria = ad_group_criterion_service.mutate(
-        operations)['value']
+            'operand': {
+                'xsi_type': 'BiddableAdGroupCriterion',
+                'adGroupId': ad_group_id,
+                'criterion': {
+                    'xsi_type': 'Keyword',
+                    'matchType': keyword.targeting,
+                    'text': keyword.text
+                }
+            }
+        })
+
+    partial_failure = client.partial_failure
+    client.partial_failure = True
+    try:
+        ad_group_criterion_service = client.GetService(
+            'AdGroupCriterionService', version=ADWORDS_VERSION)
+        result = ad_group_criterion_service.mutate(operations)
+    finally:
+        client.partial_failure = partial_failure
+
+    errors = {}
+    if 'partialFailureErrors' in result and result['partialFailureErrors']:
+        for error in result['partialFailureErrors']:
+            index = get_adwords_error_operation_index(error)
+            if index is None:
+                # Not related to a keyword : the other keywords may be created
+                print('Adwords error not related to a keyword : ' + error['errorString'])
+            else:
+                errors.setdefault(index, error['errorString'])
+
+    rejected_keywords = []
+    for index in sorted(errors):
+        rejected_keywords.append((keywords[index], errors[index]))
+    return rejected_keywords
 
 # ----------------
 
@@ -266,6 +333,240 @@ def get_adwords_ads_group_keywords(client, adgroup_id):
 
 # ----------------
 
+"""
+Return all the entries of a service, page after page.
+"""
+def get_adwords_all_entries(service, selector):
+    offset = 0
+    selector['paging'] = {
+        'startIndex': str(offset),
+        'numberResults': str(PAGE_SIZE)
+    }
+    more_pages = True
+    entries = []
+
+    while more_pages:
+        page = service.get(selector)
+        if 'entries' in page and page['entries']:
+            entries.extend(page['entries'])
+        offset += PAGE_SIZE
+        selector['paging']['startIndex'] = str(offset)
+        more_pages = offset < int(page['totalNumEntries'])
+
+    return entries
+
+"""
+Get all adwords campaigns IDs from a customer account.
+Returns a dict (name -> id).
+"""
+def get_adwords_campaign_ids(client):
+    campaign_service = client.GetService('CampaignService', version=ADWORDS_VERSION)
+    selector = {
+        'fields': ['Id', 'Name'],
+    }
+    campaign_ids = {}
+    for campaign in get_adwords_all_entries(campaign_service, selector):
+        campaign_ids[campaign['name']] = campaign['id']
+    return campaign_ids
+
+"""
+Get all adwords ads groups IDs from a campaign.
+Returns a dict (name -> id).
+"""
+def get_adwords_ads_group_ids(client, campaign_id):
+    ad_group_service = client.GetService('AdGroupService', version=ADWORDS_VERSION)
+    selector = {
+        'fields': ['Id', 'Name'],
+        'predicates': [
+            {
+                'field': 'CampaignId',
+                'operator': 'EQUALS',
+                'values': [campaign_id]
+            }
+        ],
+    }
+    ads_group_ids = {}
+    for ad_group in get_adwords_all_entries(ad_group_service, selector):
+        ads_group_ids[ad_group['name']] = ad_group['id']
+    return ads_group_ids
+
+"""
+Get all adwords keywords from an ads group.
+Returns a set of (text, match type).
+"""
+def get_adwords_keyword_set(client, adgroup_id):
+    ad_group_criterion_service = client.GetService('AdGroupCriterionService', version=ADWORDS_VERSION)
+    selector = {
+        'fields': ['Id', 'CriteriaType', 'KeywordMatchType', 'KeywordText'],
+        'predicates': [
+            {
+                'field': 'AdGroupId',
+                'operator': 'EQUALS',
+                'values': [adgroup_id]
+            },
+            {
+                'field': 'CriteriaType',
+                'operator': 'EQUALS',
+                'values': ['KEYWORD']
+            }
+        ],
+    }
+    keywords = set()
+    for keyword in get_adwords_all_entries(ad_group_criterion_service, selector):
+        keywords.add((keyword['criterion']['text'], keyword['criterion']['matchType']))
+    return keywords
+
+"""
+Count the keywords of an ads group without downloading them.
+"""
+def count_adwords_ads_group_keywords(client, adgroup_id):
+    ad_group_criterion_service = client.GetService('AdGroupCriterionService', version=ADWORDS_VERSION)
+    selector = {
+        'fields': ['Id'],
+        'predicates': [
+            {
+                'field': 'AdGroupId',
+                'operator': 'EQUALS',
+                'values': [adgroup_id]
+            },
+            {
+                'field': 'CriteriaType',
+                'operator': 'EQUALS',
+                'values': ['KEYWORD']
+            }
+        ],
+        'paging': {
+            'startIndex': '0',
+            'numberResults': '1'
+        },
+    }
+    page = ad_group_criterion_service.get(selector)
+    return int(page['totalNumEntries'])
+
+"""
+Get only the given keyword texts from an ads group, using IN predicates
+on KeywordText (by chunks).
+Returns a set of (text, match type).
+"""
+def get_adwords_keyword_set_in(client, adgroup_id, texts):
+    ad_group_criterion_service = client.GetService('AdGroupCriterionService', version=ADWORDS_VERSION)
+    texts = sorted(set(texts))
+    keywords = set()
+    for start in range(0, len(texts), KEYWORDS_LOOKUP_CHUNK_SIZE):
+        selector = {
+            'fields': ['Id', 'CriteriaType', 'KeywordMatchType', 'KeywordText'],
+            'predicates': [
+                {
+                    'field': 'AdGroupId',
+                    'operator': 'EQUALS',
+                    'values': [adgroup_id]
+                },
+                {
+                    'field': 'CriteriaType',
+                    'operator': 'EQUALS',
+                    'values': ['KEYWORD']
+                },
+                {
+                    'field': 'KeywordText',
+                    'operator': 'IN',
+                    'values': texts[start:start + KEYWORDS_LOOKUP_CHUNK_SIZE]
+                }
+            ],
+        }
+        for keyword in get_adwords_all_entries(ad_group_criterion_service, selector):
+            keywords.add((keyword['criterion']['text'], keyword['criterion']['matchType']))
+    return keywords
+
+"""
+Tell if looking up some keyword texts is cheaper than downloading all
+the keywords of the ads group.
+"""
+def is_keywords_lookup_cheaper(nb_texts, nb_ads_group_keywords):
+    return nb_texts < nb_ads_group_keywords * KEYWORDS_LOOKUP_RATIO
+
+"""
+Get the existing keywords of an ads group among the given texts, with a
+lookup or a full download, whichever is the cheapest.
+Returns a set of (text, match type).
+"""
+def get_adwords_existing_keywords(client, adgroup_id, texts):
+    texts = set(texts)
+    if len(texts) == 0:
+        return set()
+    nb_ads_group_keywords = count_adwords_ads_group_keywords(client, adgroup_id)
+    if nb_ads_group_keywords == 0:
+        return set()
+    if is_keywords_lookup_cheaper(len(texts), nb_ads_group_keywords):
+        return get_adwords_keyword_set_in(client, adgroup_id, texts)
+    return get_adwords_keyword_set(client, adgroup_id)
+
+# ----------------
+
+"""
+Return an empty account snapshot, with the same structures as the sync :
+campaigns (name -> id), ads groups (campaign id -> (name -> id)) and
+keywords (ads group id -> set of (text, match type)).
+"""
+def get_empty_adwords_snapshot():
+    return {
+        'campaign_ids': {},
+        'ads_group_ids': {},
+        'keywords': {},
+    }
+
+"""
+Yield the rows of a gzipped CSV report, decompressing the stream on the fly.
+"""
+def read_adwords_report_rows(stream):
+    with gzip.GzipFile(fileobj=stream) as gzip_file:
+        for row in csv.reader(io.TextIOWrapper(gzip_file, encoding='utf-8', newline='')):
+            yield row
+
+"""
+Add the rows of a structure report (gzipped CSV, no headers) to a snapshot.
+The report can be downloaded from Adwords or read from a local file.
+"""
+def load_adwords_structure_report(snapshot, stream):
+    for row in read_adwords_report_rows(stream):
+        campaign_id = int(row[0])
+        snapshot['campaign_ids'][row[1]] = campaign_id
+        ads_group_ids = snapshot['ads_group_ids'].setdefault(campaign_id, {})
+        if len(row) < 4:
+            continue
+        ad_group_id = int(row[2])
+        ads_group_ids[row[3]] = ad_group_id
+        keywords = snapshot['keywords'].setdefault(ad_group_id, set())
+        if len(row) < 6:
+            continue
+        keywords.add((row[4], row[5]))
+    return snapshot
+
+"""
+Get the whole account structure with streamed reports instead of paged
+get calls (much faster for accounts with many ads groups).
+"""
+def get_adwords_snapshot(client):
+    report_downloader = client.GetReportDownloader(version=ADWORDS_VERSION)
+    snapshot = get_empty_adwords_snapshot()
+    for report_type, nb_fields in STRUCTURE_REPORTS:
+        query = 'SELECT ' + ', '.join(STRUCTURE_REPORT_FIELDS[:nb_fields]) + ' FROM ' + report_type
+        stream = report_downloader.DownloadReportAsStreamWithAwql(
+            query,
+            'GZIPPED_CSV',
+            skip_report_header=True,
+            skip_column_header=True,
+            skip_report_summary=True,
+            include_zero_impressions=True,
+            use_raw_enum_values=True
+        )
+        try:
+            load_adwords_structure_report(snapshot, stream)
+        finally:
+            stream.close()
+    return snapshot
+
+# ----------------
+
 """
 Get the Adwords campaign ID.
 """
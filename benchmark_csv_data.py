@@ -0,0 +1,187 @@
+# Copyright 2019 Arthur Cassarin-Grand
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from csv_data import *
+from generate_keywords_csv import generate_keywords_csv, DEFAULT_TARGETING_MIX
+from main import headings_map, targeting_map
+
+DEFAULT_SIZES = '10000,30000,100000,1000000' # Add 5000000 with --sizes
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+DEFAULT_TOLERANCE = 0.3 # 30% slower or bigger is a regression
+DEFAULT_REPEAT = 5 # Each duration is the best of these runs
+REPEAT_TIME_LIMIT = 10 # Stop repeating a slow function after these seconds
+MIN_REGRESSION_SECONDS = 0.1 # Smaller slowdowns are measurement noise
+MIN_REGRESSION_BYTES = 1024 * 1024
+
+# These functions remove duplicates with add_item_if_not_exists(), which
+# compares each item with all the others : they are skipped above this size
+# unless --nocap is given (about 30 s for get_ads_keywords at 30 000 rows).
+QUADRATIC_FUNCTIONS = ['get_ads_groups', 'get_ads_keywords']
+MAX_QUADRATIC_ROWS = 30000
+
+"""
+Return the benchmarked functions, each one called with the CSV file
+and the keyword texts it contains.
+"""
+def get_benchmarks(delimiter):
+    return {
+        'get_ads_campaigns': lambda file, texts: get_ads_campaigns(file, headings_map, delimiter),
+        'get_ads_groups': lambda file, texts: get_ads_groups(file, headings_map, delimiter),
+        'get_ads_keywords': lambda file, texts: get_ads_keywords(file, headings_map, targeting_map, delimiter),
+        'clear_string_for_api': lambda file, texts: [clear_string_for_api(text) for text in texts],
+        'get_broad_modified': lambda file, texts: [get_broad_modified(text) for text in texts],
+    }
+
+"""
+Return the path of the synthetic CSV file for a size, generating it if needed.
+Cardinalities grow with the size, like real files.
+"""
+def get_benchmark_file(data_dir, rows, targeting_mix, delimiter):
+    file = os.path.join(data_dir, 'keywords_' + str(rows) + '.csv')
+    if not os.path.exists(file):
+        print('Generating ' + file + '...')
+        generate_keywords_csv(
+            file,
+            rows,
+            max(1, rows // 10000),
+            max(1, rows // 100),
+            max(1, rows // 5),
+            targeting_mix,
+            delimiter
+        )
+    return file
+
+"""
+Run a function several times and keep its best duration, then once with
+tracemalloc for its memory peak (tracemalloc slows the code down, so it
+isn't timed). The garbage collector is off while timing, like timeit.
+"""
+def run_benchmark(function, file, texts, with_memory, repeat=DEFAULT_REPEAT):
+    best_time = None
+    total_time = 0
+    for i in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start_time = time.perf_counter()
+            function(file, texts)
+            duration = time.perf_counter() - start_time
+        finally:
+            gc.enable()
+        if best_time is None or duration < best_time:
+            best_time = duration
+        total_time += duration
+        if total_time > REPEAT_TIME_LIMIT:
+            break
+    result = {'seconds': round(best_time, 4)}
+    if with_memory:
+        tracemalloc.start()
+        function(file, texts)
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+"""
+Compare results with a baseline. A result is a regression if it's more
+than tolerance times worse and worse by more than the noise minimums.
+Returns a list of regression messages.
+"""
+def get_regressions(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for measure, value in result.items():
+            if measure not in baseline[name] or baseline[name][measure] == 0:
+                continue
+            ratio = value / baseline[name][measure]
+            if measure == 'seconds':
+                minimum = MIN_REGRESSION_SECONDS
+            else:
+                minimum = MIN_REGRESSION_BYTES
+            if ratio > 1 + tolerance and value - baseline[name][measure] > minimum:
+                regressions.append(name + ' ' + measure + ' : ' + str(baseline[name][measure]) + ' -> ' + str(value) + ' (x' + str(round(ratio, 2)) + ')')
+    return regressions
+
+def main(args):
+    parser=argparse.ArgumentParser(description='Benchmarks the csv_data functions on synthetic CSV files.')
+    parser.add_argument('-sizes','--sizes', '-n', help='Numbers of rows, for exemple ' + DEFAULT_SIZES, default=DEFAULT_SIZES)
+    parser.add_argument('-functions','--functions', '-f', help='Benchmarked functions, comma separated (all by default).')
+    parser.add_argument('-targeting','--targeting', '-t', help='Targeting mix, for exemple ' + DEFAULT_TARGETING_MIX, default=DEFAULT_TARGETING_MIX)
+    parser.add_argument('-delimiter','--delimiter', '-d', help='CSV delimiter, for exemple , or ;', default=';')
+    parser.add_argument('-datadir','--datadir', help='Where the synthetic CSV files are kept between runs.', default='benchmark_data')
+    parser.add_argument('-baseline','--baseline', '-b', help='The baseline JSON file.', default=DEFAULT_BASELINE)
+    parser.add_argument('-save','--save', '-s', help='Save the results as the new baseline.', action='store_true')
+    parser.add_argument('-tolerance','--tolerance', help='Allowed slowdown before a regression is flagged, for exemple 0.3 for 30%%.', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('-nomemory','--nomemory', help='Only measure durations.', action='store_true')
+    parser.add_argument('-repeat','--repeat', '-r', help='Runs of each function, the best duration is kept.', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('-nocap','--nocap', help='Also run ' + ', '.join(QUADRATIC_FUNCTIONS) + ' above ' + str(MAX_QUADRATIC_ROWS) + ' rows (can take days).', action='store_true')
+    args=parser.parse_args()
+
+    benchmarks = get_benchmarks(args.delimiter)
+    names = list(benchmarks)
+    if args.functions:
+        names = args.functions.split(',')
+        for name in names:
+            if name not in benchmarks:
+                print('Unknown function : ' + name + ' (must be one of ' + ', '.join(benchmarks) + ').')
+                sys.exit(1)
+
+    if not os.path.exists(args.datadir):
+        os.makedirs(args.datadir)
+
+    results = {}
+    for size in [int(size) for size in args.sizes.split(',')]:
+        file = get_benchmark_file(args.datadir, size, args.targeting, args.delimiter)
+        texts = [row[headings_map['text']] for line_counter, row in read_csv_rows(file, args.delimiter)]
+        for name in names:
+            if name in QUADRATIC_FUNCTIONS and size > MAX_QUADRATIC_ROWS and not args.nocap:
+                print(name + ' [' + str(size) + ' rows] : skipped (see --nocap)')
+                continue
+            result = run_benchmark(benchmarks[name], file, texts, not args.nomemory, args.repeat)
+            results[name + '/' + str(size)] = result
+            line = name + ' [' + str(size) + ' rows] : ' + str(result['seconds']) + ' s'
+            if 'peak_bytes' in result:
+                line += ', ' + str(round(result['peak_bytes'] / 1024 / 1024, 1)) + ' MB peak'
+            print(line)
+
+    exit_code = 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = get_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            exit_code = 1
+        else:
+            print('No regression against ' + args.baseline)
+
+    if args.save:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print('Baseline saved into ' + args.baseline)
+
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main(sys.argv)
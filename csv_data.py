@@ -13,13 +13,44 @@
 # limitations under the License.
 
 import csv
+import heapq
+import math
+import os
 import sys
+import tempfile
+import zlib
 
 from googleads import adwords
 
 DEFAULT_ADS_CAMPAIGN_BUDGET = 100000 # Equal to 0,10€/$/etc.
 DEFAULT_ADS_GROUP_BID_AMOUNT = 100000
 
+# External duplicates removal (see read_unique_rows())
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024 # In bytes
+MEMORY_PER_DATA_BYTE = 10 # Python memory used to dedup 1 byte of data, roughly
+MAX_SPILL_FILES = 512
+
+# Caracters refused by the Google Adwords API
+ILLEGAL_CARACTERS = [
+    "@",
+    "!",
+    ",",
+    "%",
+    "^",
+    "*",
+    "(",
+    ")",
+    "=",
+    "{",
+    "}",
+    "~",
+    "`",
+    "<",
+    ">",
+    "?",
+    "|"
+]
+
 class AdsCampaign(object):
     def __init__(self, name, budget):
         self.name = name
@@ -38,40 +69,63 @@ class AdsGroup(object):
         return self.name == other.name
 
 class AdsKeyword(object):
-    def __init__(self, text, targeting, ads_group):
+    def __init__(self, text, targeting, ads_group, line=None):
         self.text = text
         self.targeting = targeting
         self.ads_group = ads_group
+        self.line = line # CSV line the keyword comes from
 
     def __eq__(self, other):
         return self.text == other.text and self.targeting == other.targeting
 
+"""
+Write the keywords rejected by Adwords into a CSV file, with the same
+headings as the imported file plus the CSV line and the error, so they can
+be fixed and imported again.
+The file is only created when the first keyword is rejected.
+"""
+class RejectedRowsWriter(object):
+    def __init__(self, file, headings_map, targeting_map, delimiter):
+        self.file = file
+        self.headings_map = headings_map
+        self.targeting_map = targeting_map
+        self.delimiter = delimiter
+        self.csv_file = None
+        self.csv_writer = None
+        self.count = 0
+
+    def write(self, campaign_name, keyword, error):
+        if self.csv_file is None:
+            self.csv_file = open(self.file, 'w', newline='')
+            self.csv_writer = csv.writer(self.csv_file, delimiter=self.delimiter)
+            self.csv_writer.writerow([
+                'Line',
+                self.headings_map['text'],
+                self.headings_map['ads_group'],
+                self.headings_map['targeting'],
+                self.headings_map['campaign'],
+                'Error',
+            ])
+        self.csv_writer.writerow([
+            keyword.line,
+            keyword.text,
+            keyword.ads_group,
+            self.targeting_map.get(keyword.targeting, keyword.targeting),
+            campaign_name,
+            error,
+        ])
+        self.count += 1
+
+    def close(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+
 """
 Prevent illegal caracters for Google Adwords API
 """
 def clear_string_for_api(text):
     text = text.replace("’","'")
-    illegal_caracters = [
-        "@",
-        "!",
-        ",",
-        "%",
-        "^",
-        "*",
-        "(",
-        ")",
-        "=",
-        "{",
-        "}",
-        "~",
-        "`",
-        "<",
-        ">",
-        "?",
-        "|"
-    ]
-
-    for illegal_caracter in illegal_caracters:
+    for illegal_caracter in ILLEGAL_CARACTERS:
         text = text.replace(illegal_caracter, "")
 
     return text
@@ -102,6 +156,75 @@ def get_broad_modified(keyword):
     keyword = keyword.replace(' ', ' +')
     return keyword
 
+"""
+Return the Broad-Phrase-Exact keywords of a 'BPE' keyword :
+"keyword", [keyword] and +keyword.
+"""
+def get_bpe_keywords(keyword):
+    return [
+        AdsKeyword(keyword.text, 'PHRASE', keyword.ads_group, keyword.line),
+        AdsKeyword(keyword.text, 'EXACT', keyword.ads_group, keyword.line),
+        AdsKeyword(get_broad_modified(keyword.text), 'BROAD', keyword.ads_group, keyword.line),
+    ]
+
+"""
+Match a CSV targeting with a Google Ads API criterion.
+"""
+def get_targeting(targeting, targeting_map, line_counter):
+    if targeting == targeting_map['BROAD']:
+        return 'BROAD'
+    elif targeting == targeting_map['PHRASE']:
+        return 'PHRASE'
+    elif targeting == targeting_map['EXACT']:
+        return 'EXACT'
+    elif targeting == targeting_map['BPE']:
+        return 'BPE'
+    print('The keyword n°' + str(line_counter) + ' has an invalid targeting (must match the heading_targeting pattern).')
+    sys.exit(1)
+
+"""
+Yield the CSV rows one by one with their line number, without loading
+the whole file in memory.
+"""
+def read_csv_rows(file, delimiter):
+    with open(file, 'r') as csv_file:
+        csv_reader = csv.DictReader(csv_file, delimiter=delimiter)
+        line_counter = 0
+        for row in csv_reader:
+            line_counter += 1
+            yield line_counter, row
+
+"""
+Return the AdsCampaign(), AdsGroup() and AdsKeyword() of a single CSV row.
+"""
+def get_row_entities(row, line_counter, headings_map, targeting_map):
+    # Check integrity
+    try:
+        for heading in ['campaign', 'ads_group', 'text', 'targeting']:
+            if row[headings_map[heading]] == '':
+                print('The line n°' + str(line_counter) + ' has no ' + heading + '.')
+                sys.exit(1)
+    except KeyError:
+        print('The CSV delimiter must be wrong or the CSV file doesn\'t respect the heading map (see main.py file).')
+        sys.exit(1)
+    # Create entities
+    campaign = AdsCampaign(
+        clear_string_for_api(row[headings_map['campaign']]),
+        DEFAULT_ADS_CAMPAIGN_BUDGET
+    )
+    ads_group = AdsGroup(
+        clear_string_for_api(row[headings_map['ads_group']]),
+        DEFAULT_ADS_GROUP_BID_AMOUNT,
+        campaign.name
+    )
+    keyword = AdsKeyword(
+        clear_string_for_api(row[headings_map['text']]),
+        get_targeting(row[headings_map['targeting']], targeting_map, line_counter),
+        ads_group.name,
+        line_counter
+    )
+    return campaign, ads_group, keyword
+
 """
 Return a list of AdsCampaign() with no duplicates.
 """
@@ -175,23 +298,108 @@ def get_ads_keywords(file, headings_map, targeting_map, delimiter):
                 print('The keyword n°' + str(line_counter) + ' has no ads group.')
                 sys.exit(1)
             # Create entity
-            targeting = row[headings_map['targeting']]
             # Match targeting with Google Ads API criterion
-            if targeting == targeting_map['BROAD']:
-                targeting = 'BROAD'
-            elif targeting == targeting_map['PHRASE']:
-                targeting = 'PHRASE'
-            elif targeting == targeting_map['EXACT']:
-                targeting = 'EXACT'
-            elif targeting == targeting_map['BPE']:
-                targeting = 'BPE'
-            else:
-                print('The keyword n°' + str(line_counter) + ' has an invalid targeting (must match the heading_targeting pattern).')
-                sys.exit(1)
+            targeting = get_targeting(row[headings_map['targeting']], targeting_map, line_counter)
             keyword = AdsKeyword(
                 clear_string_for_api(row[headings_map['text']]),
                 targeting,
-                clear_string_for_api(row[headings_map['ads_group']])
+                clear_string_for_api(row[headings_map['ads_group']]),
+                line_counter
             )
             add_item_if_not_exists(keyword, ads_keywords)
     return ads_keywords
+
+"""
+Return the number of spill files needed to remove the duplicates of some
+data within a memory budget. data_size is the size of the data as CSV text
+(the file size for a CSV file, see get_parquet_data_size() for Parquet).
+Sizes are in bytes.
+"""
+def get_spill_partitions(data_size, memory_budget=DEFAULT_MEMORY_BUDGET):
+    nb_partitions = max(math.ceil(data_size * MEMORY_PER_DATA_BYTE / memory_budget), 1)
+    if nb_partitions > MAX_SPILL_FILES:
+        used_memory = data_size * MEMORY_PER_DATA_BYTE / MAX_SPILL_FILES
+        print('Warning : ' + str(nb_partitions) + ' temporary files would be needed but only ' +
+            str(MAX_SPILL_FILES) + ' are used, duplicates removal will use about ' +
+            str(round(used_memory / 1024 / 1024)) + ' MB of memory instead of ' +
+            str(round(memory_budget / 1024 / 1024)) + ' MB.')
+        return MAX_SPILL_FILES
+    return nb_partitions
+
+"""
+Yield the rows (from read_csv_rows() or read_parquet_rows()) with no
+duplicate keywords, without keeping all of them in memory.
+The rows are hash-partitioned on their (text, targeting, ads group) key into
+temporary spill files, then each partition is deduplicated on its own.
+Rows come back in partition order, or in the original order (merged by line
+number) if original_order is True. Either way, all the rows are read before
+the first one comes back.
+"""
+def read_unique_rows(rows, headings_map, targeting_map, nb_partitions, original_order=True):
+    # Spilled rows : line, key, then the mapped columns
+    headings = list(headings_map.values())
+    print('Removing duplicate keywords with ' + str(nb_partitions) + ' temporary files...')
+    with tempfile.TemporaryDirectory(prefix='keywords_dedup_') as spill_dir:
+        # Spill the checked rows into partitions
+        spill_files = [
+            open(os.path.join(spill_dir, 'partition_' + str(i) + '.csv'), 'w', newline='')
+            for i in range(nb_partitions)
+        ]
+        spill_writers = [csv.writer(spill_file) for spill_file in spill_files]
+        for line_counter, row in rows:
+            campaign, ads_group, keyword = get_row_entities(row, line_counter, headings_map, targeting_map)
+            key = '\t'.join([campaign.name, ads_group.name, keyword.text, keyword.targeting])
+            partition = zlib.crc32(key.encode('utf-8')) % nb_partitions
+            spill_writers[partition].writerow([line_counter, key] + [row[heading] for heading in headings])
+        for spill_file in spill_files:
+            spill_file.close()
+
+        # Dedup each partition, rows are already in the file order
+        unique_files = []
+        for i in range(nb_partitions):
+            partition_file = os.path.join(spill_dir, 'partition_' + str(i) + '.csv')
+            if original_order:
+                unique_files.append(os.path.join(spill_dir, 'unique_' + str(i) + '.csv'))
+                unique_file = open(unique_files[-1], 'w', newline='')
+                unique_writer = csv.writer(unique_file)
+            keys = set()
+            with open(partition_file, 'r', newline='') as spill_file:
+                for spilled_row in csv.reader(spill_file):
+                    if spilled_row[1] in keys:
+                        continue
+                    keys.add(spilled_row[1])
+                    if original_order:
+                        unique_writer.writerow(spilled_row)
+                    else:
+                        yield int(spilled_row[0]), dict(zip(headings, spilled_row[2:]))
+            os.remove(partition_file)
+            if original_order:
+                unique_file.close()
+
+        if not original_order:
+            return
+
+        # Merge the partitions back by line number
+        unique_spill_files = [open(unique_file, 'r', newline='') for unique_file in unique_files]
+        try:
+            readers = [csv.reader(unique_spill_file) for unique_spill_file in unique_spill_files]
+            for spilled_row in heapq.merge(*readers, key=lambda spilled_row: int(spilled_row[0])):
+                yield int(spilled_row[0]), dict(zip(headings, spilled_row[2:]))
+        finally:
+            for unique_spill_file in unique_spill_files:
+                unique_spill_file.close()
+
+"""
+Return a generator of AdsKeyword() with no duplicates (same text, targeting
+and ads group), for CSV files too big to be deduplicated in memory.
+"""
+def get_ads_keywords_external(file, headings_map, targeting_map, delimiter, memory_budget=DEFAULT_MEMORY_BUDGET, original_order=True):
+    rows = read_unique_rows(
+        read_csv_rows(file, delimiter),
+        headings_map,
+        targeting_map,
+        get_spill_partitions(os.path.getsize(file), memory_budget),
+        original_order
+    )
+    for line_counter, row in rows:
+        yield get_row_entities(row, line_counter, headings_map, targeting_map)[2]
@@ -0,0 +1,109 @@
+# Copyright 2019 Arthur Cassarin-Grand
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import csv
+import random
+import sys
+
+from main import headings_map, targeting_map
+
+DEFAULT_TARGETING_MIX = 'BROAD=40,PHRASE=20,EXACT=20,BPE=20'
+
+# Syllables used to build fake words, and caracters removed by clear_string_for_api()
+SYLLABLES = ['ba', 'ko', 'ri', 'mu', 'te', 'lo', 'sa', 'ni', 'pe', 'do', 'fa', 'zu']
+NOISE = ['', '', '', '', '!', '’', '(', ')', '?', ',']
+
+"""
+Parse a targeting mix like 'BROAD=40,PHRASE=20,EXACT=20,BPE=20'.
+Returns a list of (targeting, weight).
+"""
+def parse_targeting_mix(targeting_mix):
+    mix = []
+    for item in targeting_mix.split(','):
+        targeting, weight = item.split('=')
+        if targeting not in targeting_map:
+            print('Unknown targeting : ' + targeting + ' (must be one of ' + ', '.join(targeting_map) + ').')
+            sys.exit(1)
+        mix.append((targeting, int(weight)))
+    return mix
+
+"""
+Return a fake word, always the same for the same random generator state.
+"""
+def get_fake_word(generator):
+    return ''.join(generator.choice(SYLLABLES) for i in range(generator.randint(2, 4)))
+
+"""
+Write a synthetic keywords CSV file with the main.py headings.
+The same arguments (seed included) always give the same file.
+"""
+def generate_keywords_csv(file, rows, nb_campaigns, nb_ads_groups, nb_keywords, targeting_mix, delimiter, seed=0):
+    generator = random.Random(seed)
+    mix = parse_targeting_mix(targeting_mix)
+    targetings = [targeting_map[targeting] for targeting, weight in mix]
+    weights = [weight for targeting, weight in mix]
+
+    campaigns = ['[EN] Campaign ' + get_fake_word(generator) + ' ' + str(i) for i in range(nb_campaigns)]
+    # Each ads group belongs to one campaign
+    ads_groups = []
+    for i in range(nb_ads_groups):
+        ads_groups.append(('Group ' + get_fake_word(generator) + ' ' + str(i), campaigns[i % nb_campaigns]))
+    keywords = []
+    for i in range(nb_keywords):
+        words = [get_fake_word(generator) for j in range(generator.randint(1, 4))]
+        keywords.append(' '.join(words) + generator.choice(NOISE))
+
+    with open(file, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=delimiter)
+        csv_writer.writerow([
+            headings_map['text'],
+            headings_map['ads_group'],
+            headings_map['targeting'],
+            headings_map['campaign'],
+        ])
+        for i in range(rows):
+            ads_group, campaign = generator.choice(ads_groups)
+            csv_writer.writerow([
+                generator.choice(keywords),
+                ads_group,
+                generator.choices(targetings, weights)[0],
+                campaign,
+            ])
+
+def main(args):
+    parser=argparse.ArgumentParser(description='Generates a synthetic keywords CSV file for tests and benchmarks.')
+    parser.add_argument('-output','--output', '-o', help='The CSV file to write.', required=True)
+    parser.add_argument('-rows','--rows', '-n', help='Number of rows.', type=int, default=10000)
+    parser.add_argument('-campaigns','--campaigns', help='Number of different campaigns.', type=int, default=10)
+    parser.add_argument('-adsgroups','--adsgroups', help='Number of different ads groups.', type=int, default=100)
+    parser.add_argument('-keywords','--keywords', help='Number of different keyword texts.', type=int, default=2000)
+    parser.add_argument('-targeting','--targeting', '-t', help='Targeting mix, for exemple ' + DEFAULT_TARGETING_MIX, default=DEFAULT_TARGETING_MIX)
+    parser.add_argument('-delimiter','--delimiter', '-d', help='CSV delimiter, for exemple , or ;', default=';')
+    parser.add_argument('-seed','--seed', help='Random seed.', type=int, default=0)
+    args=parser.parse_args()
+
+    generate_keywords_csv(
+        args.output,
+        args.rows,
+        args.campaigns,
+        args.adsgroups,
+        args.keywords,
+        args.targeting,
+        args.delimiter,
+        args.seed
+    )
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -22,6 +22,8 @@ from googleads.errors import *
 
 from csv_data import *
 from adwords_engine import *
+from parquet_data import get_parquet_data_size, get_parquet_entities, read_parquet_rows
+from pipeline import check_rows, run_pipeline
 
 # Make the match with your CSV file headings (here in french)
 headings_map = {
@@ -38,6 +40,25 @@ targeting_map = {
     "BPE":"BPE", # Broad with +, Phrase and Expression
 }
 
+"""
+Ask the user before sending anything to the Adwords account.
+"""
+def ask_import_confirmation():
+    start_script_input = input("Do you want to import your data into Google Ads ? [Y/N] : ")
+    if start_script_input == "N" or start_script_input == "n":
+        sys.exit(0)
+    elif start_script_input != "Y" and start_script_input != "y":
+        print("Bad user input, exit script.")
+        sys.exit(1)
+
+"""
+Return the rows of the data file (CSV or Parquet), one by one.
+"""
+def read_data_rows(data_file, file_extension, delimiter):
+    if file_extension == '.parquet':
+        return read_parquet_rows(data_file, headings_map)
+    return read_csv_rows(data_file, delimiter)
+
 def main(args):
     # Check if Python 3
     if (sys.version_info < (3, 0)):
@@ -45,15 +66,33 @@ def main(args):
         sys.exit(1)
 
     parser=argparse.ArgumentParser()
-    parser.add_argument('-csv','--csv', '-c', help='The CSV file that contains keywords, ads groups and campaigns.', required=True)
+    parser.add_argument('-csv','--csv', '-c', help='The CSV (or Parquet) file that contains keywords, ads groups and campaigns.', required=True)
     parser.add_argument('-idadwords','--idadwords', '-a', help='The account Adwords that will receive new keywords, ads groups and campaigns. I.e. 123-456-7891 or 1234567891', required=True)
-    parser.add_argument('-delimiter','--delimiter', '-d', help='CSV delimiter, for exemple , or ;', required=True)
+    parser.add_argument('-delimiter','--delimiter', '-d', help='CSV delimiter, for exemple , or ; (not used for Parquet files)')
+    parser.add_argument('-pipeline','--pipeline', '-p', help='Send data to Adwords while the CSV file is still read (recommended for big files).', action='store_true')
+    parser.add_argument('-snapshot','--snapshot', '-s', help='With -pipeline, load the account structure with reports first (recommended for big accounts).', action='store_true')
+    parser.add_argument('-memory','--memory', '-m', help='With -pipeline, remove duplicate keywords with temporary files, using about this memory in MB (for files bigger than RAM). The whole file is then read before the first campaign is synced.', type=int)
+    parser.add_argument('-rejected','--rejected', '-r', help='The CSV file that will contain the keywords rejected by Adwords. By default : <csv file name>_rejected.csv')
     args=parser.parse_args()
 
     csv_file = args.csv
     filename, file_extension = os.path.splitext(csv_file)
-    if file_extension != '.csv':
-        print('The data file must be a CSV type format.')
+    if file_extension != '.csv' and file_extension != '.parquet':
+        print('The data file must be a CSV or Parquet type format.')
+        sys.exit(1)
+    if file_extension == '.csv' and args.delimiter is None:
+        print('The CSV delimiter is required for CSV files.')
+        sys.exit(1)
+
+    rejected_file = args.rejected
+    if rejected_file is None:
+        rejected_file = filename + '_rejected.csv'
+
+    if args.snapshot and not args.pipeline:
+        print('The -snapshot option requires the -pipeline option.')
+        sys.exit(1)
+    if args.memory is not None and not args.pipeline:
+        print('The -memory option requires the -pipeline option.')
         sys.exit(1)
 
     delimiter = args.delimiter
@@ -70,15 +109,56 @@ def main(args):
     client = adwords.AdWordsClient.LoadFromStorage(path="googleads.yaml")
     client.SetClientCustomerId(customer_service_id)
 
+    rejected_rows = RejectedRowsWriter(rejected_file, headings_map, targeting_map, delimiter or ';')
+
+    if args.pipeline:
+        # Entities are created while the file is read, so check it all first
+        nb_rows = check_rows(read_data_rows(csv_file, file_extension, delimiter), headings_map, targeting_map)
+        print('CSV file is OK.')
+        print('Rows found in CSV file : ' + str(nb_rows))
+        ask_import_confirmation()
+        print('Adwords API running...')
+        snapshot = None
+        if args.snapshot:
+            print('Loading account structure from reports...')
+            snapshot = get_adwords_snapshot(client)
+        try:
+            rows = read_data_rows(csv_file, file_extension, delimiter)
+            if args.memory is not None:
+                if file_extension == '.parquet':
+                    data_size = get_parquet_data_size(csv_file, headings_map)
+                else:
+                    data_size = os.path.getsize(csv_file)
+                rows = read_unique_rows(
+                    rows,
+                    headings_map,
+                    targeting_map,
+                    get_spill_partitions(data_size, args.memory * 1024 * 1024)
+                )
+            counters = run_pipeline(client, rows, headings_map, targeting_map, snapshot, rejected_rows, args.memory is not None)
+        finally:
+            rejected_rows.close()
+        print('Campaigns created : ' + str(counters['campaigns']) + ' on ' + str(counters['campaigns_found']) + ' found')
+        print('Ads groups created : ' + str(counters['ads_groups']) + ' on ' + str(counters['ads_groups_found']) + ' found')
+        print('Keywords created : ' + str(counters['keywords']) + ' on ' + str(counters['keywords_found']) + ' found')
+        if rejected_rows.count > 0:
+            print('Keywords rejected : ' + str(rejected_rows.count) + ' (see ' + rejected_file + ')')
+        processed_time = round(time.time() - start_time,2)
+        print("Finished in %s seconds" % processed_time)
+        return
+
     # Counters
     created_campaigns = 0
     created_ads_groups = 0
     created_keywords = 0
 
     # Get CSV entities (Campaigns, Ads groups, Keywords)
-    csv_campaigns = get_ads_campaigns(csv_file, headings_map, delimiter)
-    csv_ads_groups = get_ads_groups(csv_file, headings_map, delimiter)
-    csv_keywords = get_ads_keywords(csv_file, headings_map, targeting_map, delimiter)
+    if file_extension == '.parquet':
+        csv_campaigns, csv_ads_groups, csv_keywords = get_parquet_entities(csv_file, headings_map, targeting_map)
+    else:
+        csv_campaigns = get_ads_campaigns(csv_file, headings_map, delimiter)
+        csv_ads_groups = get_ads_groups(csv_file, headings_map, delimiter)
+        csv_keywords = get_ads_keywords(csv_file, headings_map, targeting_map, delimiter)
     nb_campaigns = str(count_elements(csv_campaigns))
     nb_ads_groups = str(count_elements(csv_ads_groups))
     nb_keywords = str(count_elements(csv_keywords))
@@ -88,12 +168,7 @@ def main(args):
     print('Ads groups found in CSV file : ' + nb_ads_groups)
     print('Keywords found in CSV file : ' + nb_keywords)
 
-    start_script_input = input("Do you want to import your data into Google Ads ? [Y/N] : ")
-    if start_script_input == "N" or start_script_input == "n":
-        sys.exit(0)
-    elif start_script_input != "Y" and start_script_input != "y":
-        print("Bad user input, exit script.")
-        sys.exit(1)
+    ask_import_confirmation()
 
     print('Adwords API running...')
 
@@ -138,66 +213,45 @@ def main(args):
                 adwords_ad_group_id = get_adwords_ad_group_id(client, csv_ads_group.name, campaign_id)
 
                 # --- Create keywords for this ads group
+                ads_group_keywords = []
                 for csv_keyword in csv_keywords:
                     # If the keyword belongs to the ads group
                     if csv_keyword.ads_group == csv_ads_group.name:
                         if csv_keyword.targeting == 'BPE':
-                            print("Creating Broad-Phrase-Exact Keywords for " + csv_keyword.text + "' keyword")
-                            # -- PHRASE --
-                            csv_keyword.targeting = "PHRASE"
-                            print("Create '" + csv_keyword.text + "' keyword [Targeting : " + csv_keyword.targeting + "]")
-                            create_adwords_keyword(client, adwords_ad_group_id, csv_keyword)
-                            # Refresh the account ads group's keywords list
-                            account_ads_group_keywords = get_adwords_ads_group_keywords(
-                                client,
-                                adwords_ad_group_id,
-                            )
-                            created_keywords += 1
-                            # -- EXACT --
-                            csv_keyword.targeting = "EXACT"
-                            print("Create '" + csv_keyword.text + "' keyword [Targeting : " + csv_keyword.targeting + "]")
-                            create_adwords_keyword(client, adwords_ad_group_id, csv_keyword)
-                            # Refresh the account ads group's keywords list
-                            account_ads_group_keywords = get_adwords_ads_group_keywords(
-                                client,
-                                adwords_ad_group_id,
-                            )
-                            created_keywords += 1
-                            # -- BROAD MODIFIED --
-                            csv_keyword.text = get_broad_modified(csv_keyword.text)
-                            csv_keyword.targeting = 'BROAD'
-                            print("Create '" + csv_keyword.text + "' keyword [Targeting : " + csv_keyword.targeting + "]")
-                            create_adwords_keyword(client, adwords_ad_group_id, csv_keyword)
-                            # Refresh the account ads group's keywords list
-                            account_ads_group_keywords = get_adwords_ads_group_keywords(
-                                client,
-                                adwords_ad_group_id,
-                            )
-                            created_keywords += 1
-                            
-                        else: 
-                            # Check if the ads group already exists (based on it's name)
-                            account_ads_group_keywords = get_adwords_ads_group_keywords(
-                                client,
-                                adwords_ad_group_id,
-                            )
-                            exists = False
-                            for account_ads_group_keyword in account_ads_group_keywords:
-                                if account_ads_group_keyword['criterion']['text'] == csv_keyword.text:
-                                    exists = True
-                            if exists == False:
-                                print("Create '" + csv_keyword.text + "' keyword [Targeting : " + csv_keyword.targeting + "]")
-                                create_adwords_keyword(client, adwords_ad_group_id, csv_keyword)
-                                # Refresh the account ads group's keywords list
-                                account_ads_group_keywords = get_adwords_ads_group_keywords(
-                                    client,
-                                    adwords_ad_group_id,
-                                )
-                                created_keywords += 1
+                            print("Creating Broad-Phrase-Exact Keywords for '" + csv_keyword.text + "' keyword")
+                            ads_group_keywords.extend(get_bpe_keywords(csv_keyword))
+                        else:
+                            ads_group_keywords.append(csv_keyword)
+
+                # Check which keywords already exist (based on their text and targeting)
+                account_ads_group_keywords = get_adwords_existing_keywords(
+                    client,
+                    adwords_ad_group_id,
+                    [csv_keyword.text for csv_keyword in ads_group_keywords],
+                )
+                new_keywords = []
+                for csv_keyword in ads_group_keywords:
+                    if (csv_keyword.text, csv_keyword.targeting) not in account_ads_group_keywords:
+                        print("Create '" + csv_keyword.text + "' keyword [Targeting : " + csv_keyword.targeting + "]")
+                        new_keywords.append(csv_keyword)
+                        account_ads_group_keywords.add((csv_keyword.text, csv_keyword.targeting))
+
+                # Send them by batches, a rejected keyword doesn't stop the others
+                for start in range(0, len(new_keywords), KEYWORDS_BATCH_SIZE):
+                    batch = new_keywords[start:start + KEYWORDS_BATCH_SIZE]
+                    rejected_keywords = create_adwords_keywords(client, adwords_ad_group_id, batch)
+                    for csv_keyword, error in rejected_keywords:
+                        print("Rejected '" + csv_keyword.text + "' keyword (CSV line " + str(csv_keyword.line) + ") : " + error)
+                        rejected_rows.write(csv_campaign.name, csv_keyword, error)
+                    created_keywords += len(batch) - len(rejected_keywords)
+
+    rejected_rows.close()
 
     print('Campaigns created : ' + str(created_campaigns) + ' on ' + nb_campaigns + ' found')
     print('Ads groups created : ' + str(created_ads_groups) + ' on ' + nb_ads_groups + ' found')
     print('Keywords created : ' + str(created_keywords) + ' on ' + nb_keywords + ' found')
+    if rejected_rows.count > 0:
+        print('Keywords rejected : ' + str(rejected_rows.count) + ' (see ' + rejected_file + ')')
     processed_time = round(time.time() - start_time,2)
     print("Finished in %s seconds" % processed_time)
 
@@ -0,0 +1,218 @@
+# Copyright 2019 Arthur Cassarin-Grand
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import re
+import sys
+
+# pyarrow is only needed to read Parquet files
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from csv_data import *
+
+HEADINGS = ['text', 'ads_group', 'targeting', 'campaign']
+PARQUET_BATCH_SIZE = 10000 # Rows read at once by read_parquet_rows()
+
+"""
+Stop the script if pyarrow isn't installed.
+"""
+def check_pyarrow():
+    if pyarrow is None:
+        print('Reading Parquet files requires pyarrow : pip3 install pyarrow')
+        sys.exit(1)
+
+"""
+Read only the headings_map columns of a Parquet file.
+"""
+def read_parquet_columns(file, headings_map):
+    check_pyarrow()
+    columns = [headings_map[heading] for heading in HEADINGS]
+    try:
+        return pyarrow.parquet.read_table(file, columns=columns)
+    except (KeyError, pyarrow.ArrowInvalid):
+        print('The Parquet file doesn\'t respect the heading map (see main.py file).')
+        sys.exit(1)
+
+"""
+Return a column as strings, like the CSV values (a Parquet column can be
+typed, for example an int64 ads group).
+"""
+def cast_parquet_column(column):
+    if column.type == pyarrow.string():
+        return column
+    try:
+        return pyarrow.compute.cast(column, pyarrow.string())
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError):
+        print('The Parquet file doesn\'t respect the heading map (see main.py file).')
+        sys.exit(1)
+
+"""
+Stop the script if a column has an empty value.
+"""
+def check_parquet_column(column, heading):
+    empty = pyarrow.compute.fill_null(pyarrow.compute.equal(column, ''), True)
+    line = pyarrow.compute.index(empty, True).as_py()
+    if line != -1:
+        print('The line n°' + str(line + 1) + ' has no ' + heading + '.')
+        sys.exit(1)
+
+"""
+Vectorized clear_string_for_api() : only the distinct values (the dictionary)
+of the column are cleaned.
+"""
+def clear_parquet_column(column):
+    encoded = pyarrow.compute.dictionary_encode(column)
+    dictionary = pyarrow.compute.replace_substring(encoded.dictionary, '’', "'")
+    dictionary = pyarrow.compute.replace_substring_regex(
+        dictionary,
+        '[' + re.escape(''.join(ILLEGAL_CARACTERS)) + ']',
+        ''
+    )
+    return dictionary.take(encoded.indices)
+
+"""
+Vectorized get_targeting() : each distinct targeting of the column is
+matched once with a Google Ads API criterion.
+"""
+def get_parquet_targeting_column(column, targeting_map):
+    encoded = pyarrow.compute.dictionary_encode(column)
+    criteria = {}
+    for criterion, targeting in targeting_map.items():
+        criteria[targeting] = criterion
+    dictionary = []
+    invalid_codes = []
+    for code, targeting in enumerate(encoded.dictionary.to_pylist()):
+        if targeting not in criteria:
+            invalid_codes.append(code)
+        dictionary.append(criteria.get(targeting))
+    if invalid_codes:
+        invalid = pyarrow.compute.is_in(encoded.indices, value_set=pyarrow.array(invalid_codes, encoded.indices.type))
+        line = pyarrow.compute.index(invalid, True).as_py()
+        print('The keyword n°' + str(line + 1) + ' has an invalid targeting (must match the heading_targeting pattern).')
+        sys.exit(1)
+    return pyarrow.array(dictionary, pyarrow.string()).take(encoded.indices)
+
+"""
+Return the checked and cleaned columns of a Parquet file, as arrays
+(text, ads_group, targeting, campaign).
+"""
+def get_parquet_columns(file, headings_map, targeting_map):
+    table = read_parquet_columns(file, headings_map)
+    columns = {}
+    for heading in HEADINGS:
+        column = cast_parquet_column(table.column(headings_map[heading]).combine_chunks())
+        check_parquet_column(column, heading)
+        if heading == 'targeting':
+            columns[heading] = get_parquet_targeting_column(column, targeting_map)
+        else:
+            columns[heading] = clear_parquet_column(column)
+    return columns
+
+"""
+Return the first row of each distinct value of the keys columns, in the
+file order (like add_item_if_not_exists()).
+"""
+def get_parquet_first_rows(columns, keys):
+    table = pyarrow.table(dict(
+        [(key, columns[key]) for key in keys] +
+        [('row', pyarrow.array(range(len(columns[keys[0]])), pyarrow.int64()))]
+    ))
+    first_rows = table.group_by(keys).aggregate([('row', 'min')]).column('row_min').combine_chunks()
+    return first_rows.take(pyarrow.compute.sort_indices(first_rows))
+
+"""
+Return the lists of AdsCampaign(), AdsGroup() and AdsKeyword() of a
+Parquet file, with no duplicates : the same entities as get_ads_campaigns(),
+get_ads_groups() and get_ads_keywords() for the same data in a CSV file.
+"""
+def get_parquet_entities(file, headings_map, targeting_map):
+    columns = get_parquet_columns(file, headings_map, targeting_map)
+
+    campaigns = []
+    for name in pyarrow.compute.unique(columns['campaign']).to_pylist():
+        campaigns.append(AdsCampaign(name, DEFAULT_ADS_CAMPAIGN_BUDGET))
+
+    ads_groups = []
+    rows = get_parquet_first_rows(columns, ['ads_group'])
+    for name, campaign in zip(
+        columns['ads_group'].take(rows).to_pylist(),
+        columns['campaign'].take(rows).to_pylist()
+    ):
+        ads_groups.append(AdsGroup(name, DEFAULT_ADS_GROUP_BID_AMOUNT, campaign))
+
+    keywords = []
+    rows = get_parquet_first_rows(columns, ['text', 'targeting'])
+    for text, targeting, ads_group, row in zip(
+        columns['text'].take(rows).to_pylist(),
+        columns['targeting'].take(rows).to_pylist(),
+        columns['ads_group'].take(rows).to_pylist(),
+        rows.to_pylist()
+    ):
+        keywords.append(AdsKeyword(text, targeting, ads_group, row + 1))
+
+    return campaigns, ads_groups, keywords
+
+"""
+Return the size the headings_map columns of a Parquet file would have as
+CSV text (the file itself is compressed), from its number of rows and the
+average width of its first rows.
+"""
+def get_parquet_data_size(file, headings_map):
+    check_pyarrow()
+    columns = [headings_map[heading] for heading in HEADINGS]
+    parquet_file = pyarrow.parquet.ParquetFile(file)
+    nb_rows = parquet_file.metadata.num_rows
+    if nb_rows == 0:
+        return 0
+    try:
+        batch = next(parquet_file.iter_batches(batch_size=PARQUET_BATCH_SIZE, columns=columns))
+    except (KeyError, pyarrow.ArrowInvalid):
+        print('The Parquet file doesn\'t respect the heading map (see main.py file).')
+        sys.exit(1)
+    # 1 delimiter or line break per value
+    sample_size = batch.num_rows * len(columns)
+    for heading in columns:
+        lengths = pyarrow.compute.binary_length(cast_parquet_column(batch.column(heading)))
+        sample_size += pyarrow.compute.sum(lengths).as_py() or 0
+    return math.ceil(sample_size / batch.num_rows * nb_rows)
+
+"""
+Yield the Parquet rows one by one with their line number, like
+read_csv_rows(), reading only the headings_map columns by batches.
+"""
+def read_parquet_rows(file, headings_map):
+    check_pyarrow()
+    columns = [headings_map[heading] for heading in HEADINGS]
+    parquet_file = pyarrow.parquet.ParquetFile(file)
+    line_counter = 0
+    try:
+        for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_SIZE, columns=columns):
+            batch = pyarrow.RecordBatch.from_arrays(
+                [cast_parquet_column(batch.column(heading)) for heading in columns],
+                names=columns
+            )
+            for row in batch.to_pylist():
+                line_counter += 1
+                for heading in columns:
+                    if row[heading] is None:
+                        row[heading] = ''
+                yield line_counter, row
+    except (KeyError, pyarrow.ArrowInvalid):
+        print('The Parquet file doesn\'t respect the heading map (see main.py file).')
+        sys.exit(1)
@@ -0,0 +1,306 @@
+# Copyright 2019 Arthur Cassarin-Grand
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import queue
+import threading
+
+from csv_data import *
+from adwords_engine import *
+
+# The import runs as 4 stages connected by bounded queues :
+# rows reader -> normalize and dedup -> planner -> mutate batcher (Adwords API).
+# A full queue blocks the previous stage, so the queues stay bounded and the
+# API calls start as soon as the first rows are read. The duplicates check
+# and the known account keywords still grow with the number of keywords.
+QUEUE_SIZE = 1000 # Max items waiting between two stages
+MAX_PENDING_KEYWORDS = 5000 # Keywords held by the planner before flushing all ads groups
+
+_END = object()
+
+class _Cancelled(Exception):
+    pass
+
+class _Stage(threading.Thread):
+    def __init__(self, cancel, target, *args):
+        threading.Thread.__init__(self, daemon=True)
+        self.cancel = cancel
+        self.stage_target = target
+        self.stage_args = args
+        self.error = None
+
+    def run(self):
+        try:
+            self.stage_target(*self.stage_args)
+        except _Cancelled:
+            pass
+        except BaseException as error:
+            # Includes SystemExit raised by the CSV integrity checks
+            self.error = error
+            self.cancel.set()
+
+"""
+Put an item into a bounded queue, waiting while it's full.
+"""
+def _put(items_queue, item, cancel):
+    while True:
+        if cancel.is_set():
+            raise _Cancelled()
+        try:
+            items_queue.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+"""
+Get an item from a queue, waiting while it's empty.
+"""
+def _get(items_queue, cancel):
+    while True:
+        if cancel.is_set():
+            raise _Cancelled()
+        try:
+            return items_queue.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+"""
+Stage 1 : read the file row by row (from read_csv_rows() or read_parquet_rows()).
+"""
+def read_rows_stage(rows, rows_queue, cancel):
+    for line_counter, row in rows:
+        _put(rows_queue, (line_counter, row), cancel)
+    _put(rows_queue, _END, cancel)
+
+"""
+Stage 2 : check and clean the rows, then drop duplicates.
+A campaign or an ads group is sent the first time it's seen, so it can be
+synced while the next rows are still read.
+Keywords aren't deduplicated here if the rows are already unique (see
+read_unique_rows()), so their keys aren't kept in memory.
+"""
+def normalize_stage(rows_queue, entities_queue, headings_map, targeting_map, counters, cancel, unique_rows=False):
+    campaigns = set()
+    ads_groups = set()
+    keywords = set()
+    while True:
+        item = _get(rows_queue, cancel)
+        if item is _END:
+            break
+        line_counter, row = item
+        campaign, ads_group, keyword = get_row_entities(row, line_counter, headings_map, targeting_map)
+        if campaign.name not in campaigns:
+            campaigns.add(campaign.name)
+            counters['campaigns_found'] += 1
+            _put(entities_queue, ('campaign', campaign), cancel)
+        ads_group_key = (ads_group.campaign_name, ads_group.name)
+        if ads_group_key not in ads_groups:
+            ads_groups.add(ads_group_key)
+            counters['ads_groups_found'] += 1
+            _put(entities_queue, ('ads_group', ads_group), cancel)
+        keyword_key = (ads_group.campaign_name, ads_group.name, keyword.text, keyword.targeting)
+        if unique_rows or keyword_key not in keywords:
+            if not unique_rows:
+                keywords.add(keyword_key)
+            counters['keywords_found'] += 1
+            _put(entities_queue, ('keyword', ads_group, keyword), cancel)
+    _put(entities_queue, _END, cancel)
+
+"""
+Stage 3 : expand 'BPE' keywords and group keywords by ads group into
+batches for the mutate calls.
+"""
+def plan_stage(entities_queue, operations_queue, batch_size, cancel):
+    pending = {} # (campaign name, ads group name) -> (AdsGroup(), keywords)
+    pending_keywords = 0
+    while True:
+        item = _get(entities_queue, cancel)
+        if item is _END:
+            break
+        if item[0] != 'keyword':
+            _put(operations_queue, item, cancel)
+            continue
+        ads_group, keyword = item[1], item[2]
+        key = (ads_group.campaign_name, ads_group.name)
+        if key not in pending:
+            pending[key] = (ads_group, [])
+        if keyword.targeting == 'BPE':
+            planned_keywords = get_bpe_keywords(keyword)
+        else:
+            planned_keywords = [keyword]
+        pending[key][1].extend(planned_keywords)
+        pending_keywords += len(planned_keywords)
+        if len(pending[key][1]) >= batch_size:
+            pending_keywords -= len(pending[key][1])
+            _put(operations_queue, ('keywords',) + pending.pop(key), cancel)
+        elif pending_keywords >= MAX_PENDING_KEYWORDS:
+            for ads_group, keywords in pending.values():
+                _put(operations_queue, ('keywords', ads_group, keywords), cancel)
+            pending = {}
+            pending_keywords = 0
+    for ads_group, keywords in pending.values():
+        _put(operations_queue, ('keywords', ads_group, keywords), cancel)
+    _put(operations_queue, _END, cancel)
+
+"""
+Stage 4 : create the missing campaigns, ads groups and keywords.
+The account structure is loaded when first needed and kept up to date,
+unless a snapshot of the whole account is given.
+Keywords rejected by Adwords are written to rejected_rows (a RejectedRowsWriter()).
+"""
+def sync_stage(client, operations_queue, counters, cancel, snapshot=None, rejected_rows=None):
+    if snapshot is None:
+        campaign_ids = get_adwords_campaign_ids(client)
+        ads_group_ids = {} # campaign id -> (ads group name -> id)
+        account_keywords = {} # ads group id -> set of (text, match type)
+        complete_ads_groups = set() # ads groups ids whose keywords are all known
+    else:
+        campaign_ids = snapshot['campaign_ids']
+        ads_group_ids = snapshot['ads_group_ids']
+        account_keywords = snapshot['keywords']
+        complete_ads_groups = set(account_keywords)
+    ads_group_sizes = {} # ads group id -> number of keywords on Adwords
+    while True:
+        item = _get(operations_queue, cancel)
+        if item is _END:
+            break
+
+        if item[0] == 'campaign':
+            campaign = item[1]
+            if campaign.name not in campaign_ids:
+                print("Create '" + campaign.name + "' campaign")
+                campaign_id = create_adwords_campaign(client, campaign)
+                campaign_ids[campaign.name] = campaign_id
+                # A new campaign has no ads groups to look up
+                ads_group_ids[campaign_id] = {}
+                counters['campaigns'] += 1
+
+        elif item[0] == 'ads_group':
+            ads_group = item[1]
+            campaign_id = campaign_ids[ads_group.campaign_name]
+            if campaign_id not in ads_group_ids:
+                ads_group_ids[campaign_id] = get_adwords_ads_group_ids(client, campaign_id)
+            if ads_group.name not in ads_group_ids[campaign_id]:
+                print("Create '" + ads_group.name + "' ads group")
+                ad_group_id = create_adwords_ad_group(client, campaign_id, ads_group)
+                ads_group_ids[campaign_id][ads_group.name] = ad_group_id
+                # A new ads group has no keywords to look up
+                account_keywords[ad_group_id] = set()
+                complete_ads_groups.add(ad_group_id)
+                counters['ads_groups'] += 1
+
+        else:
+            ads_group, keywords = item[1], item[2]
+            campaign_id = campaign_ids[ads_group.campaign_name]
+            ad_group_id = ads_group_ids[campaign_id][ads_group.name]
+            if ad_group_id not in complete_ads_groups:
+                # Only the keywords of this batch are looked up, unless the
+                # ads group is small enough to be downloaded once for all
+                if ad_group_id not in ads_group_sizes:
+                    ads_group_sizes[ad_group_id] = count_adwords_ads_group_keywords(client, ad_group_id)
+                texts = set(keyword.text for keyword in keywords)
+                if ads_group_sizes[ad_group_id] == 0:
+                    account_keywords[ad_group_id] = set()
+                    complete_ads_groups.add(ad_group_id)
+                elif is_keywords_lookup_cheaper(len(texts), ads_group_sizes[ad_group_id]):
+                    account_keywords.setdefault(ad_group_id, set()).update(
+                        get_adwords_keyword_set_in(client, ad_group_id, texts))
+                else:
+                    account_keywords[ad_group_id] = get_adwords_keyword_set(client, ad_group_id)
+                    complete_ads_groups.add(ad_group_id)
+            existing_keywords = account_keywords[ad_group_id]
+            new_keywords = []
+            for keyword in keywords:
+                if (keyword.text, keyword.targeting) not in existing_keywords:
+                    existing_keywords.add((keyword.text, keyword.targeting))
+                    new_keywords.append(keyword)
+                    print("Create '" + keyword.text + "' keyword [Targeting : " + keyword.targeting + "]")
+            if new_keywords:
+                rejected_keywords = create_adwords_keywords(client, ad_group_id, new_keywords)
+                for keyword, error in rejected_keywords:
+                    print("Rejected '" + keyword.text + "' keyword (CSV line " + str(keyword.line) + ") : " + error)
+                    existing_keywords.discard((keyword.text, keyword.targeting))
+                    if rejected_rows is not None:
+                        rejected_rows.write(ads_group.campaign_name, keyword, error)
+                counters['keywords'] += len(new_keywords) - len(rejected_keywords)
+                counters['rejected_keywords'] += len(rejected_keywords)
+
+"""
+Check all the rows before the import starts : the pipeline creates entities
+while the file is read, so an invalid row found later would stop a half-done
+import.
+Returns the number of rows.
+"""
+def check_rows(rows, headings_map, targeting_map):
+    nb_rows = 0
+    for line_counter, row in rows:
+        get_row_entities(row, line_counter, headings_map, targeting_map)
+        nb_rows += 1
+    return nb_rows
+
+"""
+Tell what was already created when the import stops on an error.
+"""
+def _print_stopped_import(counters):
+    print('Import stopped, already created : ' +
+        str(counters['campaigns']) + ' campaigns, ' +
+        str(counters['ads_groups']) + ' ads groups, ' +
+        str(counters['keywords']) + ' keywords.')
+
+"""
+Import the rows of a file (see read_rows_stage()) into the Adwords account
+with the 4 stages running at the same time.
+Returns the found/created counters.
+"""
+def run_pipeline(client, rows, headings_map, targeting_map, snapshot=None, rejected_rows=None, unique_rows=False):
+    cancel = threading.Event()
+    rows_queue = queue.Queue(QUEUE_SIZE)
+    entities_queue = queue.Queue(QUEUE_SIZE)
+    operations_queue = queue.Queue(QUEUE_SIZE)
+    counters = {
+        'campaigns_found': 0,
+        'ads_groups_found': 0,
+        'keywords_found': 0,
+        'campaigns': 0,
+        'ads_groups': 0,
+        'keywords': 0,
+        'rejected_keywords': 0,
+    }
+
+    stages = [
+        _Stage(cancel, read_rows_stage, rows, rows_queue, cancel),
+        _Stage(cancel, normalize_stage, rows_queue, entities_queue, headings_map, targeting_map, counters, cancel, unique_rows),
+        _Stage(cancel, plan_stage, entities_queue, operations_queue, KEYWORDS_BATCH_SIZE, cancel),
+    ]
+    for stage in stages:
+        stage.start()
+
+    try:
+        sync_stage(client, operations_queue, counters, cancel, snapshot, rejected_rows)
+    except _Cancelled:
+        pass
+    except BaseException:
+        _print_stopped_import(counters)
+        raise
+    finally:
+        # Stop the other stages if the API stage failed
+        cancel.set()
+        for stage in stages:
+            stage.join()
+
+    for stage in stages:
+        if stage.error is not None:
+            _print_stopped_import(counters)
+            raise stage.error
+
+    return counters
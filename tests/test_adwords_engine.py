@@ -0,0 +1,105 @@
+# Copyright 2019 Arthur Cassarin-Grand
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+try:
+    import googleads
+except ImportError:
+    googleads = None
+
+if googleads is not None:
+    from adwords_engine import *
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# Same order as STRUCTURE_REPORTS
+STRUCTURE_REPORT_FIXTURES = [
+    'campaigns_report.csv.gz',
+    'ads_groups_report.csv.gz',
+    'keywords_report.csv.gz',
+]
+
+"""
+Load the 3 fixture reports into a snapshot, like get_adwords_snapshot().
+"""
+def load_fixture_snapshot():
+    snapshot = get_empty_adwords_snapshot()
+    for fixture in STRUCTURE_REPORT_FIXTURES:
+        with open(os.path.join(FIXTURES_DIR, fixture), 'rb') as stream:
+            load_adwords_structure_report(snapshot, stream)
+    return snapshot
+
+@unittest.skipIf(googleads is None, 'googleads is not installed')
+class StructureReportTest(unittest.TestCase):
+    def test_load_structure_reports(self):
+        snapshot = load_fixture_snapshot()
+        self.assertEqual(snapshot['campaign_ids'], {
+            '[EN] Shoes': 111,
+            '[EN] Hats, caps': 222,
+            '[EN] Empty campaign': 333,
+        })
+        self.assertEqual(snapshot['ads_group_ids'], {
+            111: {'Running shoes': 1001, 'Empty group': 1002},
+            222: {'Caps': 2001},
+            333: {},
+        })
+        self.assertEqual(snapshot['keywords'], {
+            1001: {('running shoes', 'EXACT'), ('+running +shoes', 'BROAD')},
+            1002: set(),
+            2001: {('cap "pro"', 'PHRASE')},
+        })
+
+    def test_load_keywords_report_only(self):
+        # The keywords report alone gives the structure of non-empty ads groups
+        snapshot = get_empty_adwords_snapshot()
+        with open(os.path.join(FIXTURES_DIR, 'keywords_report.csv.gz'), 'rb') as stream:
+            load_adwords_structure_report(snapshot, stream)
+        self.assertEqual(snapshot['ads_group_ids'], {
+            111: {'Running shoes': 1001},
+            222: {'Caps': 2001},
+        })
+
+"""
+Time the loading of a fixture report, for example a big report saved from
+Adwords : python3 tests/test_adwords_engine.py keywords_report.csv.gz
+"""
+def benchmark_structure_report(file, repeat=5):
+    best_time = None
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        snapshot = get_empty_adwords_snapshot()
+        with open(file, 'rb') as stream:
+            load_adwords_structure_report(snapshot, stream)
+        duration = time.perf_counter() - start_time
+        if best_time is None or duration < best_time:
+            best_time = duration
+    print(file + ' : ' + str(round(best_time, 4)) + ' s (best of ' + str(repeat) + '), ' +
+        str(len(snapshot['campaign_ids'])) + ' campaigns, ' +
+        str(len(snapshot['keywords'])) + ' ads groups, ' +
+        str(sum(len(keywords) for keywords in snapshot['keywords'].values())) + ' keywords')
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for file in sys.argv[1:]:
+            if not os.path.exists(file):
+                file = os.path.join(FIXTURES_DIR, file)
+            benchmark_structure_report(file)
+    else:
+        unittest.main()